@@ -1,6 +1,78 @@
 import sqlite3
 import pandas as pd
 from pathlib import Path
+from typing import Iterable, Iterator
+
+# Colonne effettivamente usate dalle dashboard: tutto il resto non viene nemmeno letto da SQLite
+COLONNE_TRANSAZIONI = ["name", "amount", "paid", "income", "date_created", "category_fk", "sub_category_fk", "wallet_fk"]
+COLONNE_CATEGORIE = ["category_pk", "name"]
+
+# Tabella di lookup del flag "income" di Cashew (0 = Spesa, 1 = Entrata)
+TIPI_TRANSAZIONE = {0: "Spesa", 1: "Entrata"}
+
+# Dimensione indicativa (in caratteri) dei blocchi di statement passati a executescript
+DIMENSIONE_BLOCCO_SQL = 1 << 20
+
+
+def read_table_columns(conn: sqlite3.Connection, table: str, columns: list[str]) -> pd.DataFrame:
+    """
+    Esegue una SELECT mirata sulle sole colonne richieste che esistono davvero nella tabella,
+    così da non materializzare in pandas campi che nessuna analisi legge.
+    """
+    presenti = {row[1] for row in conn.execute(f'PRAGMA table_info("{table}")')}
+    if not presenti:
+        raise sqlite3.OperationalError(f"no such table: {table}")
+
+    colonne_scelte = [c for c in columns if c in presenti]
+    proiezione = ", ".join(f'"{c}"' for c in colonne_scelte) if colonne_scelte else "*"
+    return pd.read_sql_query(f'SELECT {proiezione} FROM "{table}"', conn)
+
+
+def iter_sql_blocks(lines: Iterable[str], dimensione_blocco: int = DIMENSIONE_BLOCCO_SQL) -> Iterator[str]:
+    """
+    Raggruppa un flusso di righe SQL in blocchi di statement completi di circa dimensione_blocco
+    caratteri. sqlite3.complete_statement viene chiamato solo sulle righe che contengono ";" e
+    solo quando gli apici dello statement in corso sono pari, cioè fuori da una stringa letterale:
+    un letterale su molte righe non viene così riscansionato ad ogni ";".
+    """
+    blocco, dimensione = [], 0
+    statement, apici = [], 0
+    for riga in lines:
+        statement.append(riga)
+        apici += riga.count("'")
+        if ";" not in riga or apici % 2:
+            continue
+        testo = "".join(statement)
+        if not sqlite3.complete_statement(testo):
+            continue
+        blocco.append(testo)
+        dimensione += len(testo)
+        statement, apici = [], 0
+        if dimensione >= dimensione_blocco:
+            yield "".join(blocco)
+            blocco, dimensione = [], 0
+    # Eventuale coda incompleta (o statement accorpati da un apice in un commento): la passiamo
+    # comunque a SQLite, che la esegue o segnala l'errore di sintassi
+    blocco.extend(statement)
+    if any(parte.strip() for parte in blocco):
+        yield "".join(blocco)
+
+
+def execute_sql_dump(conn: sqlite3.Connection, file_path: Path, dimensione_blocco: int = DIMENSIONE_BLOCCO_SQL) -> None:
+    """
+    Esegue uno script SQL testuale a blocchi tramite executescript, leggendo il file in streaming:
+    il dump non viene mai caricato in memoria per intero.
+    """
+    transazione_aperta = False
+    with open(file_path, "r", encoding="utf-8") as f:
+        for script in iter_sql_blocks(f, dimensione_blocco):
+            # executescript esegue un COMMIT implicito prima di partire: se il blocco precedente
+            # ha lasciato aperta una BEGIN del dump, la riapriamo così la sua COMMIT resta valida
+            if transazione_aperta:
+                script = "BEGIN;\n" + script
+            conn.executescript(script)
+            transazione_aperta = conn.in_transaction
+
 
 def process_sql_file(file_path: Path) -> dict:
     """
@@ -17,21 +89,30 @@ def process_sql_file(file_path: Path) -> dict:
         header = f.read(15)
     
     if header.startswith(b"SQLite format 3"):
-        conn = sqlite3.connect(str(file_path))
+        # Sola lettura e "immutable": SQLite salta journaling e locking su un file che nessuno modifica.
+        # Il database viene poi copiato in RAM, così tutte le SELECT successive non toccano più il disco.
+        src = sqlite3.connect(f"{file_path.resolve().as_uri()}?mode=ro&immutable=1", uri=True)
+        conn = sqlite3.connect(":memory:")
+        try:
+            src.backup(conn)
+        except Exception:
+            conn.close()
+            raise
+        finally:
+            src.close()
     else:
         conn = sqlite3.connect(":memory:")
         try:
-            sql_text = file_path.read_text(encoding="utf-8")
-            conn.executescript(sql_text)
+            execute_sql_dump(conn, file_path)
         except Exception as e:
             conn.close()
             raise ValueError(f"Impossibile eseguire lo script SQL testuale: {e}")
             
     try:
-        df_transactions = pd.read_sql_query("SELECT * FROM transactions", conn)
+        df_transactions = read_table_columns(conn, "transactions", COLONNE_TRANSAZIONI)
         
         try:
-            df_categories = pd.read_sql_query("SELECT * FROM categories", conn)
+            df_categories = read_table_columns(conn, "categories", COLONNE_CATEGORIE)
         except Exception:
             df_categories = pd.DataFrame(columns=["category_pk", "name"])
             
@@ -51,37 +132,34 @@ def process_sql_file(file_path: Path) -> dict:
         df_transactions["data_operazione"] = pd.to_datetime(
             df_transactions["date_created"], unit="s", errors="coerce"
         )
+        # Anno e mese derivati una sola volta qui, invece che ad ogni rerun nelle singole dashboard
+        df_transactions["anno"] = df_transactions["data_operazione"].dt.year.astype("Int32")
+        df_transactions["mese"] = df_transactions["data_operazione"].dt.month.astype("Int8")
     
-    # 2. Mappatura del tipo di transazione (0 = Spesa, 1 = Entrata)
+    # 2. Mappatura del tipo di transazione (0 = Spesa, 1 = Entrata).
+    #    Categorical: i confronti "tipo == ..." delle dashboard lavorano sui codici interi
     if "income" in df_transactions.columns:
-        df_transactions["tipo"] = df_transactions["income"].map({0: "Spesa", 1: "Entrata"})
-        
-    # 3. Unione (Merge) per recuperare la Categoria Principale
-    if not df_categories.empty and "category_fk" in df_transactions.columns:
-        df_transactions = df_transactions.merge(
-            df_categories[["category_pk", "name"]].rename(columns={"name": "categoria_nome"}),
-            left_on="category_fk",
-            right_on="category_pk",
-            how="left"
-        ).drop(columns=["category_pk"], errors="ignore")
+        df_transactions["tipo"] = pd.Categorical(
+            df_transactions["income"].map(TIPI_TRANSAZIONE), categories=list(TIPI_TRANSAZIONE.values())
+        )
+    
+    # Importo in valore assoluto (evita bug di segno - - = +), calcolato una volta per tutte le dashboard
+    if "amount" in df_transactions.columns:
+        df_transactions["amount_abs"] = df_transactions["amount"].abs()
         
-    # 4. Unione (Merge) per recuperare la Sotto-categoria (sub_category_fk)
-    if not df_categories.empty and "sub_category_fk" in df_transactions.columns:
-        df_transactions = df_transactions.merge(
-            df_categories[["category_pk", "name"]].rename(columns={"name": "sottocategoria_nome"}),
-            left_on="sub_category_fk",
-            right_on="category_pk",
-            how="left"
-        ).drop(columns=["category_pk"], errors="ignore")
+    # 3-4. Categoria Principale e Sotto-categoria (sub_category_fk) dalla stessa tabella di lookup,
+    #      costruita una sola volta invece di rifare un merge completo per ciascuna chiave
+    if not df_categories.empty:
+        nomi_categorie = df_categories.drop_duplicates("category_pk").set_index("category_pk")["name"]
+        if "category_fk" in df_transactions.columns:
+            df_transactions["categoria_nome"] = df_transactions["category_fk"].map(nomi_categorie)
+        if "sub_category_fk" in df_transactions.columns:
+            df_transactions["sottocategoria_nome"] = df_transactions["sub_category_fk"].map(nomi_categorie)
         
-    # 5. Unione (Merge) con i Wallet (Conti)
+    # 5. Nome del Wallet (Conto) tramite lookup diretta wallet_pk -> name
     if not df_wallets.empty and "wallet_fk" in df_transactions.columns:
-        df_transactions = df_transactions.merge(
-            df_wallets[["wallet_pk", "name"]].rename(columns={"name": "wallet_nome"}),
-            left_on="wallet_fk",
-            right_on="wallet_pk",
-            how="left"
-        ).drop(columns=["wallet_pk"], errors="ignore")
+        nomi_wallet = df_wallets.drop_duplicates("wallet_pk").set_index("wallet_pk")["name"]
+        df_transactions["wallet_nome"] = df_transactions["wallet_fk"].map(nomi_wallet)
         
     if "data_operazione" in df_transactions.columns:
         df_transactions = df_transactions.sort_values(by="data_operazione", ascending=False)
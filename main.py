@@ -1,27 +1,51 @@
 import streamlit as st
+import hashlib
+import shutil
 import tempfile
 import datetime
+import numpy as np
 import pandas as pd
 from pathlib import Path
 import plotly.express as px
+import plotly.graph_objects as go
 from inputToOutput import process_sql_file
 
 # --- CONFIGURAZIONE DELLA PAGINA ---
 st.set_page_config(page_title="Personal Finance Analyzer", layout="wide", page_icon="💰")
 
+# Nomi (in minuscolo) riconosciuti come colonna del saldo nella tabella wallets
+COLONNE_SALDO_WALLET = frozenset({"balance", "amount", "current_balance", "saldo", "balance_num"})
+
+# Categoria tecnica di Cashew usata per riallineare i saldi: non è una spesa reale
+CATEGORIA_CORREZIONE_SALDO = "Correzione saldo"
+
 
 # ==========================================
 # 1. FUNZIONI DI CARICAMENTO E CACHING DATA
 # ==========================================
 
+def get_file_digest(uploaded_file) -> str:
+    """
+    Restituisce l'impronta BLAKE2 del contenuto caricato, calcolata una sola volta per upload
+    e conservata in session_state: i rerun successivi non ripassano più sui byte del file.
+    """
+    file_id, digest = st.session_state.get("file_digest", (None, None))
+    if file_id != uploaded_file.file_id:
+        digest = hashlib.blake2b(uploaded_file.getbuffer(), digest_size=16).hexdigest()
+        st.session_state["file_digest"] = (uploaded_file.file_id, digest)
+    return digest
+
+
 @st.cache_data(show_spinner="Elaborazione del database in corso...")
-def load_data_from_bytes(file_bytes: bytes) -> dict:
+def load_data_from_upload(file_digest: str, _uploaded_file) -> dict:
     """
-    Scrive i byte in un file temporaneo, lo processa e pulisce il sistema.
-    Usa la cache di Streamlit per evitare di rileggere il file ad ogni interazione.
+    Copia l'upload in un file temporaneo a blocchi da 1 MiB, lo processa e pulisce il sistema.
+    Usa la cache di Streamlit indicizzata sull'impronta del file (l'upload è escluso
+    dall'hashing) per evitare di rileggere il file ad ogni interazione.
     """
+    _uploaded_file.seek(0)
     with tempfile.NamedTemporaryFile(delete=False, suffix=".sql") as tmp_file:
-        tmp_file.write(file_bytes)
+        shutil.copyfileobj(_uploaded_file, tmp_file, length=1024 * 1024)
         tmp_path = Path(tmp_file.name)
     
     try:
@@ -33,6 +57,15 @@ def load_data_from_bytes(file_bytes: bytes) -> dict:
     return data_dict
 
 
+@st.cache_data(show_spinner=False)
+def load_chronological_data(file_digest: str, _df_tx: pd.DataFrame, _df_wallets: pd.DataFrame) -> tuple[pd.DataFrame, float]:
+    """
+    Versione in cache di prepare_chronological_data, indicizzata sull'impronta del backup:
+    i widget della dashboard non fanno più ricalcolare il patrimonio cumulativo ad ogni rerun.
+    """
+    return prepare_chronological_data(_df_tx, _df_wallets)
+
+
 # ==========================================
 # 2. BUSINESS LOGIC & TRASFORMAZIONE DATI
 # ==========================================
@@ -44,27 +77,28 @@ def prepare_chronological_data(df_tx: pd.DataFrame, df_wallets: pd.DataFrame) ->
     """
     # Escludo transazioni future (non ancora pagate)
     if "paid" in df_tx.columns:
-        df_tx = df_tx[df_tx["paid"] == 1].copy()
+        df_tx = df_tx[df_tx["paid"] == 1]
         
-    df_chronological = df_tx.sort_values(by="data_operazione", ascending=True).copy()
+    # process_sql_file restituisce già i movimenti in ordine decrescente: basta invertirli.
+    # Una sola copia complessiva (sort_values restituisce già un nuovo DataFrame)
+    if df_tx["data_operazione"].is_monotonic_decreasing:
+        df_chronological = df_tx.iloc[::-1].copy()
+    else:
+        df_chronological = df_tx.sort_values(by="data_operazione", ascending=True)
     
-    # Forza il valore assoluto per evitare bug di segno (- - = +)
-    df_chronological["amount_abs"] = df_chronological["amount"].abs()
-    df_chronological["net_amount"] = df_chronological["amount_abs"].where(
-        df_chronological["tipo"] == "Entrata", -df_chronological["amount_abs"]
-    )
+    # Segno assegnato in un solo passaggio sull'array float, senza allineamenti sull'indice
+    importi_abs = df_chronological["amount_abs"].to_numpy()
+    df_chronological["net_amount"] = np.where(df_chronological["tipo"] == "Entrata", importi_abs, -importi_abs)
     
     # Somma cumulativa temporanea
     df_chronological["patrimonio_cumulativo_raw"] = df_chronological["net_amount"].cumsum()
     
     # Estrazione Patrimonio Netto Reale (da Wallets)
     patrimonio_netto_attuale = 0.0
-    colonne_saldo = [c for c in df_wallets.columns if c.lower() in ["balance", "amount", "current_balance", "saldo", "balance_num"]]
+    col_scelta = next((c for c in df_wallets.columns if c.lower() in COLONNE_SALDO_WALLET), None)
     
-    if colonne_saldo and not df_wallets.empty:
-        col_scelta = colonne_saldo[0]
-        df_wallets[col_scelta] = pd.to_numeric(df_wallets[col_scelta], errors='coerce').fillna(0)
-        patrimonio_netto_attuale = df_wallets[col_scelta].sum()
+    if col_scelta is not None and not df_wallets.empty:
+        patrimonio_netto_attuale = pd.to_numeric(df_wallets[col_scelta], errors='coerce').fillna(0).sum()
     else:
         if not df_chronological.empty:
             patrimonio_netto_attuale = df_chronological["patrimonio_cumulativo_raw"].iloc[-1]
@@ -88,20 +122,41 @@ def extract_monthly_metrics(df_chrono: pd.DataFrame) -> tuple[pd.DataFrame, str]
         return pd.DataFrame(), "Nessun Dato"
         
     oggi = datetime.datetime.now()
-    df_chrono["anno"] = df_chrono["data_operazione"].dt.year
-    df_chrono["mese"] = df_chrono["data_operazione"].dt.month
-    
-    df_mese = df_chrono[(df_chrono["anno"] == oggi.year) & (df_chrono["mese"] == oggi.month)]
+    df_mese = slice_month(df_chrono, pd.Timestamp(oggi.year, oggi.month, 1))
     label_periodo = oggi.strftime("%B %Y")
     
     if df_mese.empty:
-        ultimo_record = df_chrono.iloc[-1]
-        df_mese = df_chrono[(df_chrono["anno"] == ultimo_record["anno"]) & (df_chrono["mese"] == ultimo_record["mese"])]
-        label_periodo = ultimo_record["data_operazione"].strftime("%B %Y")
+        ultima_data = df_chrono["data_operazione"].dropna().iloc[-1]
+        df_mese = slice_month(df_chrono, pd.Timestamp(ultima_data.year, ultima_data.month, 1))
+        label_periodo = ultima_data.strftime("%B %Y")
         
     return df_mese, label_periodo
 
 
+def slice_month(df_chrono: pd.DataFrame, inizio_mese: pd.Timestamp) -> pd.DataFrame:
+    """
+    Restituisce i movimenti del mese che inizia in inizio_mese. Il DataFrame è già in ordine
+    cronologico, quindi bastano due ricerche binarie e una slice invece di una maschera sull'intero storico.
+    """
+    # Ricerca direttamente sull'array datetime64 di NumPy, senza passare dall'indicizzazione pandas
+    date = df_chrono["data_operazione"].to_numpy()
+    confini = np.array([inizio_mese, inizio_mese + pd.offsets.MonthBegin(1)], dtype=date.dtype)
+    inizio, fine = np.searchsorted(date, confini, side="left")
+    return df_chrono.iloc[inizio:fine]
+
+
+def extract_expenses(df_tx: pd.DataFrame) -> pd.DataFrame:
+    """
+    Restituisce le sole uscite reali (tipo "Spesa"), escludendo le correzioni di saldo.
+    Unico punto di filtro condiviso dalle dashboard di analisi delle spese.
+    """
+    # Le condizioni vengono combinate in un'unica maschera: una sola selezione (e copia) del DataFrame
+    maschera = df_tx["tipo"] == "Spesa"
+    if "categoria_nome" in df_tx.columns:
+        maschera = maschera & (df_tx["categoria_nome"] != CATEGORIA_CORREZIONE_SALDO)
+    return df_tx[maschera].copy()
+
+
 # ==========================================
 # 3. COMPONENTI INTERFACCIA UTENTE (UI)
 # ==========================================
@@ -110,8 +165,10 @@ def render_kpi_cards(df_mese: pd.DataFrame, patrimonio_totale: float, label_peri
     """Renderizza le metriche KPI principali in cima alla pagina."""
     st.subheader(f"📊 Indicatori Chiave ({label_periodo})")
     
-    entrate_mese = df_mese[df_mese["tipo"] == "Entrata"]["amount_abs"].sum() if not df_mese.empty else 0.0
-    uscite_mese = df_mese[df_mese["tipo"] == "Spesa"]["amount_abs"].sum() if not df_mese.empty else 0.0
+    # Un solo passaggio sulla colonna degli importi per entrambe le somme
+    somme_per_tipo = df_mese.groupby("tipo", observed=True)["amount_abs"].sum() if not df_mese.empty else pd.Series(dtype=float)
+    entrate_mese = somme_per_tipo.get("Entrata", 0.0)
+    uscite_mese = somme_per_tipo.get("Spesa", 0.0)
     cash_flow_mese = entrate_mese - uscite_mese
     tasso_risparmio = (cash_flow_mese / entrate_mese * 100) if entrate_mese > 0 else 0.0
 
@@ -142,29 +199,35 @@ def render_net_worth_chart(df_chrono: pd.DataFrame):
     st.markdown("---")
     st.subheader("📈 Andamento del Patrimonio Netto nel Tempo")
     
+    # resample(on=...) lavora direttamente sulla colonna, senza materializzare un nuovo DataFrame con set_index
     df_chart_data = (
-        df_chrono.set_index("data_operazione")
-        .resample("D")["patrimonio_cumulativo"]
+        df_chrono.resample("D", on="data_operazione")["patrimonio_cumulativo"]
         .last()
         .ffill()
     )
     st.line_chart(df_chart_data, y="patrimonio_cumulativo")
 
 
+@st.fragment
 def render_rolling_cash_flow_chart(df_chrono: pd.DataFrame):
-    """Mostra il grafico dei trend depurati dalla stagionalità mediante media mobile."""
+    """
+    Mostra il grafico dei trend depurati dalla stagionalità mediante media mobile.
+    È un fragment: muovere lo slider riesegue solo questo blocco, non l'intera dashboard.
+    """
     st.markdown("---")
     st.subheader("🔄 Trend del Flusso di Cassa su Media Mobile (Rolling Cash Flow)")
     st.write("Questa vista isola i picchi stagionali (es. tredicesime o scadenze annuali).")
 
-    df_monthly = df_chrono.copy()
-    df_monthly["mese_anno"] = df_monthly["data_operazione"].dt.to_period("M")
-    
-    df_entrate = df_monthly[df_monthly["tipo"] == "Entrata"].groupby("mese_anno")["amount_abs"].sum().rename("Entrate")
-    df_uscite = df_monthly[df_monthly["tipo"] == "Spesa"].groupby("mese_anno")["amount_abs"].sum().rename("Uscite")
-    
-    all_months = pd.period_range(start=df_monthly["mese_anno"].min(), end=df_monthly["mese_anno"].max(), freq="M")
-    df_rolling = pd.DataFrame(index=all_months).join(df_entrate, how="left").join(df_uscite, how="left").fillna(0)
+    # Un solo groupby (mese, tipo) al posto di due filtri + due aggregazioni + due join
+    mese_anno = df_chrono["data_operazione"].dt.to_period("M")
+    all_months = pd.period_range(start=mese_anno.min(), end=mese_anno.max(), freq="M")
+    df_rolling = (
+        df_chrono.groupby([mese_anno, "tipo"], observed=True)["amount_abs"].sum()
+        .unstack(fill_value=0)
+        .reindex(index=all_months, columns=["Entrata", "Spesa"], fill_value=0)
+        .rename(columns={"Entrata": "Entrate", "Spesa": "Uscite"})
+        .rename_axis(columns=None)
+    )
     
     finestra_mesi = st.slider(
         "Seleziona la finestra della media mobile (in mesi):", 
@@ -191,15 +254,52 @@ def render_transactions_preview(df_tx: pd.DataFrame):
         st.dataframe(df_tx[colonne_disponibili].head(15), use_container_width=True)
 
 
+@st.cache_data(show_spinner=False)
+def build_category_figure(df_aggregato: pd.DataFrame, tipo_grafico: str) -> go.Figure:
+    """
+    Costruisce il grafico gerarchico (Sunburst o Treemap) dai totali per categoria e sotto-categoria.
+    In cache: cambiare pagina o altri widget non ricostruisce né riserializza la figura Plotly.
+    """
+    path_gerarchia = ["categoria_nome", "sottocategoria_nome"]
+    
+    if tipo_grafico == "Sunburst (Cerchi concentrici)":
+        fig = px.sunburst(
+            df_aggregato,
+            path=path_gerarchia,
+            values="amount_abs",
+            color="categoria_nome",
+            color_discrete_sequence=px.colors.qualitative.Safe,
+            branchvalues="total"
+        )
+    else:
+        fig = px.treemap(
+            df_aggregato,
+            path=path_gerarchia,
+            values="amount_abs",
+            color="categoria_nome",
+            color_discrete_sequence=px.colors.qualitative.Safe
+        )
+
+    fig.update_traces(
+        textinfo="label+percent parent",
+        hovertemplate="<b>%{label}</b><br>Totale: € %{value:,.2f}<br>Quota: %{percentParent:.1%}"
+    )
+    fig.update_layout(
+        margin=dict(t=10, l=10, r=10, b=10),
+        height=600
+    )
+    return fig
+
+
 # ==========================================
 # 4. DASHBOARDS COMPLETE (PAGINE)
 # ==========================================
 
-def page_macro_overview(df_tx: pd.DataFrame, df_wallets: pd.DataFrame):
+def page_macro_overview(df_tx: pd.DataFrame, df_wallets: pd.DataFrame, file_digest: str):
     """Dashboard principale attuale (Stato di salute finanziaria)."""
     st.header("🏠 Dashboard: Stato di Salute Finanziaria")
     
-    df_chrono, patrimonio_attuale = prepare_chronological_data(df_tx, df_wallets)
+    df_chrono, patrimonio_attuale = load_chronological_data(file_digest, df_tx, df_wallets)
     
     if df_chrono.empty:
         st.warning("Nessun dato cronologico disponibile.")
@@ -214,8 +314,12 @@ def page_macro_overview(df_tx: pd.DataFrame, df_wallets: pd.DataFrame):
     render_transactions_preview(df_tx)
 
 
+@st.fragment
 def page_category_analysis(df_tx: pd.DataFrame):
-    """Dashboard per l'analisi dettagliata e gerarchica delle spese."""
+    """
+    Dashboard per l'analisi dettagliata e gerarchica delle spese.
+    È un fragment: cambiare anno o tipo di grafico non riesegue caricamento e routing dell'app.
+    """
     st.header("🍕 Analisi Dettagliata Spese e Categorie")
     st.write("Identifica dove si concentrano i tuoi deflussi storici sfruttando la regola di Pareto.")
 
@@ -224,18 +328,14 @@ def page_category_analysis(df_tx: pd.DataFrame):
         st.error("I dati caricati non contengono la colonna 'tipo'.")
         return
         
-    df_spese = df_tx[df_tx["tipo"] == "Spesa"].copy()
-
     # Escludiamo la categoria "Correzione saldo"
-    if "categoria_nome" in df_spese.columns:
-        df_spese = df_spese[df_spese["categoria_nome"] != "Correzione saldo"]
+    df_spese = extract_expenses(df_tx)
     
     if df_spese.empty:
         st.warning("📭 Nessuna spesa registrata nel database per questa analisi.")
         return
 
-    # 2. Preparazione dati ed eliminazione dei valori nulli per Plotly
-    df_spese["amount_abs"] = df_spese["amount"].abs()
+    # 2. Eliminazione dei valori nulli per Plotly (amount_abs arriva già da process_sql_file)
     df_spese["categoria_nome"] = df_spese["categoria_nome"].fillna("Non Specificata")
     df_spese["sottocategoria_nome"] = df_spese["sottocategoria_nome"].fillna("Generica")
 
@@ -245,15 +345,19 @@ def page_category_analysis(df_tx: pd.DataFrame):
     
     with col_filtro1:
         if "data_operazione" in df_spese.columns:
-            df_spese["anno"] = df_spese["data_operazione"].dt.year
             anni_disponibili = sorted(df_spese["anno"].dropna().unique(), reverse=True)
-            opzioni_periodo = ["Tutto lo Storico"] + [str(a) for a in anni_disponibili]
-            periodo_scelto = st.selectbox("📆 Seleziona il periodo temporale:", opzioni_periodo)
+            # Le opzioni restano numeriche (None = tutto lo storico): il testo serve solo a video
+            anno_scelto = st.selectbox(
+                "📆 Seleziona il periodo temporale:",
+                [None] + anni_disponibili,
+                format_func=lambda anno: "Tutto lo Storico" if anno is None else str(anno)
+            )
             
-            if periodo_scelto != "Tutto lo Storico":
-                df_spese = df_spese[df_spese["anno"] == int(periodo_scelto)]
+            if anno_scelto is not None:
+                df_spese = df_spese[df_spese["anno"] == anno_scelto]
         else:
-            periodo_scelto = "Tutto lo Storico"
+            anno_scelto = None
+    periodo_scelto = "Tutto lo Storico" if anno_scelto is None else str(anno_scelto)
 
     with col_filtro2:
         tipo_grafico = st.radio(
@@ -266,45 +370,15 @@ def page_category_analysis(df_tx: pd.DataFrame):
     st.subheader(f"📊 Matrice di Distribuzione delle Spese ({periodo_scelto})")
     st.caption("💡 Clicca sulle macro-categorie per esplorare le sotto-categorie nel dettaglio.")
 
-    # 4. Generazione del Grafico Plotly
-    path_gerarchia = ["categoria_nome", "sottocategoria_nome"]
-    
-    if tipo_grafico == "Sunburst (Cerchi concentrici)":
-        fig = px.sunburst(
-            df_spese,
-            path=path_gerarchia,
-            values="amount_abs",
-            color="categoria_nome",
-            color_discrete_sequence=px.colors.qualitative.Safe,
-            branchvalues="total"
-        )
-    else:
-        fig = px.treemap(
-            df_spese,
-            path=path_gerarchia,
-            values="amount_abs",
-            color="categoria_nome",
-            color_discrete_sequence=px.colors.qualitative.Safe
-        )
-
-    fig.update_traces(
-        textinfo="label+percent parent",
-        hovertemplate="<b>%{label}</b><br>Totale: € %{value:,.2f}<br>Quota: %{percentParent:.1%}"
-    )
-    fig.update_layout(
-        margin=dict(t=10, l=10, r=10, b=10),
-        height=600
-    )
+    # 4. Generazione del Grafico Plotly (a partire dai totali già aggregati, figura in cache)
+    df_aggregato = df_spese.groupby(["categoria_nome", "sottocategoria_nome"], as_index=False)["amount_abs"].sum()
+    fig = build_category_figure(df_aggregato, tipo_grafico)
 
     st.plotly_chart(fig, use_container_width=True)
 
     with st.expander("📈 Tabella di Analisi (Distribuzione Decrescente)"):
-        df_summary = (
-            df_spese.groupby(["categoria_nome", "sottocategoria_nome"])["amount_abs"]
-            .sum()
-            .reset_index()
-            .sort_values(by="amount_abs", ascending=False)
-        )
+        # Riutilizza gli stessi totali del grafico: nessuna seconda aggregazione sulle spese grezze
+        df_summary = df_aggregato.sort_values(by="amount_abs", ascending=False)
         df_summary["% sul Totale"] = (df_summary["amount_abs"] / df_summary["amount_abs"].sum()) * 100
         df_summary["% Cumulativa"] = df_summary["% sul Totale"].cumsum()
         
@@ -330,27 +404,17 @@ def page_seasonality_heatmap(df_tx: pd.DataFrame):
         return
 
     # Filtro uscite (escluse correzioni di saldo)
-    df_spese = df_tx[df_tx["tipo"] == "Spesa"].copy()
-    if "categoria_nome" in df_spese.columns:
-        df_spese = df_spese[df_spese["categoria_nome"] != "Correzione saldo"]
+    df_spese = extract_expenses(df_tx)
 
     if df_spese.empty:
         st.warning("📭 Nessuna spesa registrata nel database per questa analisi.")
         return
 
-    # Estrazione Anno e Mese
-    df_spese["amount_abs"] = df_spese["amount"].abs()
-    df_spese["anno"] = df_spese["data_operazione"].dt.year
-    df_spese["mese"] = df_spese["data_operazione"].dt.month
-
     # Creazione della matrice Pivot (Righe: Anni, Colonne: Mesi)
     df_grid = df_spese.groupby(["anno", "mese"])["amount_abs"].sum().unstack(fill_value=0)
 
     # Forza la presenza di tutti i 12 mesi per consistenza del layout grafico
-    for m in range(1, 13):
-        if m not in df_grid.columns:
-            df_grid[m] = 0.0
-    df_grid = df_grid[range(1, 13)]
+    df_grid = df_grid.reindex(columns=range(1, 13), fill_value=0.0)
     
     # Ordina gli anni in modo decrescente (l'anno più recente in alto nella Heatmap)
     df_grid = df_grid.sort_index(ascending=False)
@@ -434,8 +498,8 @@ def main():
 
     if uploaded_file is not None:
         try:
-            file_bytes = uploaded_file.getvalue()
-            data_dict = load_data_from_bytes(file_bytes)
+            file_digest = get_file_digest(uploaded_file)
+            data_dict = load_data_from_upload(file_digest, uploaded_file)
             
             df_tx = data_dict["transactions"]
             df_wallets = data_dict["wallets"]
@@ -447,7 +511,7 @@ def main():
             # --- ROUTING DELLE DASHBOARD (SIDEBAR) ---
             st.sidebar.header("🧭 Navigazione")
             PAGINE = {
-                "🏠 Panoramica Generale": lambda: page_macro_overview(df_tx, df_wallets),
+                "🏠 Panoramica Generale": lambda: page_macro_overview(df_tx, df_wallets, file_digest),
                 "🍕 Analisi Categorie": lambda: page_category_analysis(df_tx),
                 "📅 Stagionalità Pluriennale": lambda: page_seasonality_heatmap(df_tx),
                 "🔮 Budget & Previsioni (Futura)": lambda: st.info("Work in progress! In arrivo...")
@@ -0,0 +1,45 @@
+import sqlite3
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from inputToOutput import execute_sql_dump, iter_sql_blocks
+
+DUMP = """BEGIN TRANSACTION;
+CREATE TABLE t(id INTEGER PRIMARY KEY, testo TEXT);
+CREATE TABLE log(msg TEXT);
+-- commento con ; al suo interno
+CREATE TRIGGER t_ins AFTER INSERT ON t BEGIN
+    INSERT INTO log VALUES ('ins;' || NEW.id);
+    INSERT INTO log VALUES ('bis');
+END;
+INSERT INTO t VALUES (1, 'a;b'); INSERT INTO t VALUES (2, 'c');
+-- un apice spaiato nel commento (l'ultimo) accorpa gli statement seguenti senza perderli;
+/* commento ; a blocco */ INSERT INTO t VALUES (3, 'riga;
+su;
+più righe');
+COMMIT;
+"""
+
+
+def test_dump_eseguito_per_intero(tmp_path):
+    file_path = tmp_path / "dump.sql"
+    file_path.write_text(DUMP, encoding="utf-8")
+    # Blocco grande (un solo executescript) e blocco minimo (uno statement per executescript)
+    for dimensione_blocco in (1 << 20, 1):
+        conn = sqlite3.connect(":memory:")
+        execute_sql_dump(conn, file_path, dimensione_blocco)
+        assert conn.execute("SELECT testo FROM t ORDER BY id").fetchall() == [
+            ("a;b",), ("c",), ("riga;\nsu;\npiù righe",)
+        ]
+        assert conn.execute("SELECT COUNT(*) FROM log").fetchone() == (6,)
+        assert not conn.in_transaction
+
+
+def test_blocchi_con_statement_completi():
+    blocchi = list(iter_sql_blocks(DUMP.splitlines(keepends=True), dimensione_blocco=1))
+    assert "".join(blocchi) == DUMP
+    assert all(sqlite3.complete_statement(blocco) for blocco in blocchi)
+    # Il trigger resta intero nonostante i ";" del suo corpo
+    assert any("CREATE TRIGGER" in blocco and blocco.rstrip().endswith("END;") for blocco in blocchi)
@@ -0,0 +1,39 @@
+import sys
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from main import prepare_chronological_data
+
+
+def _transazioni(importi: list[float]) -> pd.DataFrame:
+    # Come process_sql_file: movimenti in ordine decrescente di data
+    date = pd.date_range("2024-01-01", periods=len(importi), freq="D")[::-1]
+    return pd.DataFrame({
+        "data_operazione": date,
+        "amount": importi,
+        "amount_abs": [abs(a) for a in importi],
+        "tipo": pd.Categorical(["Entrata"] * len(importi), categories=["Spesa", "Entrata"]),
+        "paid": 1,
+    })
+
+
+def test_patrimonio_con_importi_non_in_centesimi():
+    # Importi REAL di Cashew non arrotondati al centesimo (es. una spesa divisa in tre)
+    df_tx = _transazioni([100 / 3] * 300)
+    df_chrono, patrimonio = prepare_chronological_data(df_tx, pd.DataFrame())
+    assert patrimonio == pytest.approx(df_tx["amount"].sum())
+    assert df_chrono["patrimonio_cumulativo"].iloc[-1] == pytest.approx(df_tx["amount"].sum())
+
+
+def test_ricalibrazione_sui_saldi_wallet():
+    df_tx = _transazioni([100 / 3] * 300)
+    df_wallets = pd.DataFrame({"balance": [100 / 3, 200 / 3]})
+    df_chrono, patrimonio = prepare_chronological_data(df_tx, df_wallets)
+    assert patrimonio == pytest.approx(df_wallets["balance"].sum())
+    assert df_chrono["patrimonio_cumulativo"].iloc[-1] == pytest.approx(df_wallets["balance"].sum())
+    # Il DataFrame dei wallet non viene modificato
+    assert df_wallets["balance"].tolist() == [100 / 3, 200 / 3]